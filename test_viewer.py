@@ -0,0 +1,423 @@
+#!/usr/bin/python
+#
+# Copyright 2011 Google Inc. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import BaseHTTPServer
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import viewer
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Tests need no window
+
+def start_stub(responses, delay=0):
+  """Local stand-in for Google Books, answering ISBN paths from a dict."""
+  class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+      time.sleep(delay)
+      body = responses.get(self.path.lstrip("/"))
+      if body is None:
+        self.send_error(404)
+        return
+      self.send_response(200)
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args):
+      pass
+
+  server = BaseHTTPServer.HTTPServer(("localhost", 0), Handler)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server, "http://localhost:%d/%%s" % server.server_port
+
+class MemoryTest(unittest.TestCase):
+
+  def setUp(self):
+    self.saved = viewer.memory_budget
+    viewer.memory_budget = 100
+    viewer.memory_held.clear()
+    self.released = []
+
+  def tearDown(self):
+    viewer.memory_budget = self.saved
+    viewer.memory_held.clear()
+
+  def hold(self, name, nbytes, priority):
+    return viewer.hold_memory(name, nbytes, priority,
+                              lambda: self.released.append(name))
+
+  def test_least_recently_used_first(self):
+    self.hold("a", 30, 1)
+    self.hold("b", 30, 1)
+    self.hold("c", 30, 1)
+    viewer.touch_memory("a")
+    self.assertTrue(self.hold("d", 30, 1))
+    self.assertEqual(self.released, ["b"])
+
+  def test_higher_priority_kept(self):
+    self.hold("scratch", 40, 0)
+    self.hold("page", 40, 2)
+    self.assertTrue(self.hold("cache", 40, 1))
+    self.assertEqual(self.released, ["scratch"])
+    self.assertFalse(self.hold("more", 40, 0))
+    self.assertEqual(self.released, ["scratch"])
+
+  def test_hopeless_request_evicts_nothing(self):
+    viewer.hold_memory("pinned", 50, 2)
+    self.hold("cache", 30, 1)
+    self.assertFalse(self.hold("huge", 200, 1))
+    self.assertEqual(self.released, [])
+    self.assertTrue("cache" in viewer.memory_held)
+
+class PoolTest(unittest.TestCase):
+
+  def setUp(self):
+    self.saved = viewer.memory_budget
+    viewer.memory_held.clear()
+    viewer.surface_pool.clear()
+
+  def tearDown(self):
+    viewer.memory_budget = self.saved
+    viewer.memory_held.clear()
+    viewer.surface_pool.clear()
+
+  def test_reused_until_size_changes(self):
+    a = viewer.pooled_surface("scratch", (10, 20), 1, (255, 0, 0), 128)
+    self.assertEqual(a.get_at((0, 0))[:3], (255, 0, 0))
+    self.assertEqual(a.get_alpha(), 128)
+    self.assertTrue(viewer.pooled_surface("scratch", (10, 20), 1) is a)
+    b = viewer.pooled_surface("scratch", (20, 10), 1)
+    self.assertFalse(b is a)
+    self.assertEqual(b.get_size(), (20, 10))
+    self.assertEqual(viewer.memory_held["scratch"][0], 800)
+
+  def test_refused_over_budget(self):
+    viewer.memory_budget = 1000
+    self.assertEqual(viewer.pooled_surface("scratch", (20, 20), 1), None)
+    self.assertEqual(viewer.memory_held, {})
+    self.assertEqual(viewer.surface_pool, {})
+
+  def test_surfaces_used_together_are_evicted_together(self):
+    viewer.memory_budget = 3 * 400
+    drag = viewer.pooled_surfaces("drag", (10, 10), 1, 3)
+    self.assertEqual(len(drag), 3)
+    self.assertEqual(viewer.pooled_surfaces("drag", (10, 10), 1, 3), drag)
+    self.assertEqual(viewer.pooled_surface("zoom", (10, 10), 1).get_size(),
+                     (10, 10))
+    self.assertFalse("drag" in viewer.surface_pool)
+
+class BibliographyTest(unittest.TestCase):
+  isbn = "9780000000002"
+
+  def setUp(self):
+    self.cache = tempfile.mkdtemp()
+    self.saved = viewer.bibliography_cache, viewer.bibliography_url
+    viewer.bibliography_cache = self.cache
+    viewer.bibliography = None
+
+  def tearDown(self):
+    viewer.bibliography_cache, viewer.bibliography_url = self.saved
+    shutil.rmtree(self.cache)
+
+  def test_lookup_is_cached_by_isbn(self):
+    server, viewer.bibliography_url = start_stub({self.isbn: "%T A Title\n"})
+    self.assertEqual(viewer.get_bibliography(self.isbn + "_1"), "%T A Title\n")
+    server.shutdown()
+    server.server_close()
+    self.assertEqual(viewer.get_bibliography(self.isbn + "_2"), "%T A Title\n")
+
+  def test_missing_book(self):
+    server, viewer.bibliography_url = start_stub({})
+    bib = viewer.get_bibliography(self.isbn + "_1")
+    server.shutdown()
+    server.server_close()
+    self.assertTrue(bib.startswith("Error looking up barcode"))
+
+  def test_timeout_still_ends_lookup(self):
+    server, viewer.bibliography_url = start_stub({self.isbn: "late"}, delay=3)
+    viewer.lookup_bibliography(self.isbn + "_1")
+    server.shutdown()
+    server.server_close()
+    self.assertTrue(viewer.bibliography.startswith("Error looking up barcode"))
+
+  def test_bad_url_still_ends_lookup(self):
+    viewer.bibliography_url = "http://localhost:1/no-placeholder"
+    viewer.lookup_bibliography(self.isbn + "_1")
+    self.assertTrue(viewer.bibliography.startswith("Error looking up barcode"))
+
+class SearchIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.playground = tempfile.mkdtemp()
+    viewer.search_index = None
+    viewer.search_words.clear()
+
+  def tearDown(self):
+    shutil.rmtree(self.playground)
+
+  def write_index(self, text):
+    f = open(os.path.join(self.playground, "search_index"), "wb")
+    f.write(text)
+    f.close()
+
+  def test_later_entries_replace_earlier(self):
+    self.write_index("=000003-1-2-3\n1 2 3 4 old\n"
+                     "=000003-5-6-7\n1 2 3 4 new\n")
+    viewer.get_search_index(self.playground)
+    self.assertEqual(viewer.find_pages("old")[0], set())
+    self.assertEqual(viewer.find_pages("NEW!")[0], set([3]))
+
+  def test_truncated_index_is_skipped(self):
+    self.write_index("=000001-1-2-3\n1 2 3 4 kept\n"
+                     "=000003-1-2-3\n1 2 3\n=0000")
+    viewer.get_search_index(self.playground)
+    self.assertEqual(viewer.find_pages("kept")[0], set([1]))
+    viewer.forget_search_pages(self.playground, set([3]))
+    viewer.get_search_index(self.playground)
+    self.assertEqual(sorted(viewer.search_index), [1, 3])
+    self.assertEqual(viewer.search_index[3], ("000003", []))
+
+  def test_unparseable_hocr_is_indexed_once(self):
+    f = open(os.path.join(self.playground, "000002-1-2-3.html"), "wb")
+    f.write("<html><body><span")
+    f.close()
+    viewer.update_search_index(self.playground)
+    viewer.update_search_index(self.playground)
+    self.assertEqual(viewer.search_index[2], ("000002-1-2-3", []))
+    index = open(os.path.join(self.playground, "search_index")).read()
+    self.assertEqual(index, "=000002-1-2-3\n")
+
+class SuppressionsTest(unittest.TestCase):
+
+  def setUp(self):
+    self.playground = tempfile.mkdtemp()
+    viewer.suppressions, viewer.suppressions_stamp = set(), None
+
+  def tearDown(self):
+    shutil.rmtree(self.playground)
+
+  def test_changes_by_others_are_kept(self):
+    viewer.get_suppressions(self.playground)
+    f = open(os.path.join(self.playground, "suppressions"), "wb")
+    f.write("#Written by serve()\n7\n")
+    f.close()
+    viewer.set_suppressions(self.playground, 9)
+    viewer.suppressions = set()
+    viewer.suppressions_stamp = None
+    viewer.get_suppressions(self.playground)
+    self.assertEqual(viewer.suppressions, set([7, 9]))
+
+  def test_remote_suppression_is_idempotent(self):
+    import json
+    server = viewer.serve(self.playground, 0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    try:
+      url = "http://localhost:%d/" % server.server_address[1]
+      def suppress(method):
+        book = json.loads(viewer.fetch(url, "suppressions/5", method))
+        stored = open(os.path.join(self.playground, "suppressions")).read()
+        return book["suppressions"], stored.split("\n", 1)[1].strip()
+      self.assertEqual(suppress("PUT"), ([5], "5"))
+      self.assertEqual(suppress("PUT"), ([5], "5"))
+      self.assertEqual(suppress("DELETE"), ([], ""))
+    finally:
+      server.shutdown()
+      server.server_close()
+
+  def test_regenerated_page_gets_a_new_etag(self):
+    jpeg = os.path.join(self.playground, "000003-1-2-3.jpg")
+    open(jpeg, "wb").write("old")
+    os.utime(jpeg, (1000, 1000))
+    before = viewer.book_json(self.playground)["etags"]
+    open(jpeg, "wb").write("new")
+    os.utime(jpeg, (1000.5, 1000.5))
+    after = viewer.book_json(self.playground)["etags"]
+    self.assertEqual(sorted(after), ["000003-1-2-3.jpg"])
+    self.assertNotEqual(before, after)
+
+class SequenceTest(unittest.TestCase):
+
+  def setUp(self):
+    self.playground = tempfile.mkdtemp()
+    del viewer.sequence_edits[:]
+    viewer.remap_sequence()
+    viewer.suppressions, viewer.suppressions_stamp = set(), None
+    viewer.search_index = None
+    viewer.search_words.clear()
+
+  def tearDown(self):
+    shutil.rmtree(self.playground)
+
+  def frames(self, pages):
+    return [viewer.frame_number(page) for page in pages]
+
+  def test_blank_and_drop_on_the_same_frame(self):
+    viewer.set_sequence(self.playground, 3, "blank")
+    self.assertEqual(self.frames(range(1, 6)), [1, 2, None, 3, 4])
+    viewer.set_sequence(self.playground, 4, "drop")
+    self.assertEqual(self.frames(range(1, 6)), [1, 2, None, 4, 5])
+    del viewer.sequence_edits[:]
+    viewer.get_sequence(self.playground)
+    self.assertEqual(self.frames(range(1, 6)), [1, 2, None, 4, 5])
+
+  def test_undo(self):
+    viewer.set_sequence(self.playground, 3, "drop")
+    self.assertEqual(self.frames(range(1, 5)), [1, 2, 4, 5])
+    viewer.set_sequence(self.playground, 3, "blank")
+    viewer.set_sequence(self.playground, 5, "blank")
+    viewer.set_sequence(self.playground, 5, "drop")
+    self.assertEqual(self.frames(range(1, 7)), [1, 2, 3, 4, 5, 6])
+
+  def test_suppressions_follow_their_frames(self):
+    viewer.set_suppressions(self.playground, 1)
+    viewer.set_suppressions(self.playground, 5)
+    viewer.set_sequence(self.playground, 3, "blank")
+    self.assertEqual(viewer.suppressions, set([1, 5]))
+    self.assertEqual(self.frames([5, 6]), [4, 5])
+    viewer.set_sequence(self.playground, 2, "drop")
+    self.assertEqual(self.frames([2, 3, 4]), [None, 3, 4])
+    self.assertEqual(viewer.suppressions, set([1, 3]))
+    viewer.suppressions_stamp = None
+    viewer.get_suppressions(self.playground)
+    self.assertEqual(viewer.suppressions, set([1, 3]))
+
+  def test_undo_blank_before_a_dropped_frame(self):
+    viewer.set_sequence(self.playground, 2, "blank")
+    viewer.set_sequence(self.playground, 3, "drop")
+    self.assertEqual(self.frames(range(1, 5)), [1, None, 3, 4])
+    viewer.set_sequence(self.playground, 2, "blank")
+    self.assertEqual(viewer.sequence_edits, [(2, "drop")])
+    self.assertEqual(self.frames(range(1, 5)), [1, 3, 4, 5])
+
+  def test_export_recrops_moved_pages(self):
+    import pygame
+    pygame.init()
+    screen = pygame.display.set_mode((200, 100))
+    viewer.book_dimensions = (0, 10, 4)
+    try:
+      for frame in range(1, 5):
+        f = open(os.path.join(self.playground, "%06d.pnm" % frame), "wb")
+        f.write("P6\n4 700\n255\n" + "\x80" * (4 * 700 * 3))
+        f.close()
+        jpeg = os.path.join(self.playground, "%06d-0-10-4.jpg" % frame)
+        open(jpeg, "wb").write("old")
+      viewer.set_sequence(self.playground, 4, "blank")
+      jpegs = sorted(os.listdir(self.playground))
+      self.assertEqual([x for x in jpegs if x.endswith(".jpg")],
+                       ["000001-0-10-4.jpg", "000002-0-10-4.jpg",
+                        "000003-0-10-4.jpg"])
+      viewer.recrop(self.playground, screen)
+      self.assertEqual(pygame.image.load(os.path.join(
+          self.playground, "000005-0-10-4.jpg")).get_size(), (4, 10))
+      self.assertFalse(os.path.exists(os.path.join(
+          self.playground, "000004-0-10-4.jpg")))
+      self.assertEqual(open(os.path.join(
+          self.playground, "000003-0-10-4.jpg")).read(), "old")
+    finally:
+      viewer.book_dimensions = None
+      viewer.finish_bundle()
+      if viewer.bundle is not None:
+        viewer.bundle.close()
+      viewer.bundle, viewer.bundle_checksums = None, None
+      pygame.quit()
+
+class BundleTest(unittest.TestCase):
+
+  def setUp(self):
+    self.playground = tempfile.mkdtemp()
+    viewer.bundle, viewer.bundle_checksums = None, None
+
+  def tearDown(self):
+    if viewer.bundle is not None:
+      viewer.bundle.close()
+    viewer.bundle, viewer.bundle_checksums = None, None
+    shutil.rmtree(self.playground)
+
+  def write(self, name, data, mtime):
+    filename = os.path.join(self.playground, name)
+    open(filename, "wb").write(data)
+    os.utime(filename, (mtime, mtime))
+    return filename
+
+  def members(self):
+    import tarfile
+    viewer.bundle.fileobj.flush()
+    tar = tarfile.open(os.path.join(self.playground, "bundle.tar"))
+    members = [(m.name, tar.extractfile(m).read()) for m in tar]
+    tar.close()
+    return members
+
+  def test_appended_in_background(self):
+    viewer.bundle_file(self.playground, self.write("a.jpg", "a", 1000))
+    viewer.bundle_file(self.playground, self.write("b.jpg", "b", 1000))
+    viewer.finish_bundle()
+    self.assertEqual(self.members(), [("a.jpg", "a"), ("b.jpg", "b")])
+    viewer.bundle_checksums = None  # Journal alone says both are there
+    viewer.bundle_file(self.playground, os.path.join(self.playground, "a.jpg"))
+    viewer.finish_bundle()
+    self.assertEqual(len(self.members()), 2)
+
+  def test_rewritten_within_a_second(self):
+    filename = self.write("suppressions", "1\n", 1000.25)
+    viewer.append_bundle(self.playground, filename)
+    self.write("suppressions", "3\n", 1000.5)
+    viewer.append_bundle(self.playground, filename)
+    self.write("suppressions", "5\n", 1000.5)
+    viewer.append_bundle(self.playground, filename, force=True)
+    self.assertEqual([data for name, data in self.members()],
+                     ["1\n", "3\n", "5\n"])
+
+  def test_writer_survives_a_broken_bundle(self):
+    tar = os.path.join(self.playground, "bundle.tar")
+    open(tar, "wb").write("a.jpg".ljust(100, "\0"))  # Crashed mid header
+    viewer.bundle_file(self.playground, self.write("a.jpg", "a", 1000))
+    finished = threading.Thread(target=viewer.finish_bundle)
+    finished.daemon = True
+    finished.start()
+    finished.join(3)
+    self.assertFalse(finished.is_alive())
+    self.assertTrue(viewer.bundle_error.startswith("Bundle: "))
+    os.remove(tar)
+    viewer.bundle_file(self.playground, self.write("a.jpg", "a", 1000))
+    viewer.finish_bundle()
+    self.assertEqual(viewer.bundle_error, None)
+    self.assertEqual(self.members(), [("a.jpg", "a")])
+
+  def test_failed_append_is_cut_off(self):
+    class FailingReader(viewer.ChecksumReader):
+      def read(self, size=-1):
+        raise IOError("Disk on fire")
+    viewer.append_bundle(self.playground, self.write("a.jpg", "a", 1000))
+    saved = viewer.ChecksumReader
+    viewer.ChecksumReader = FailingReader
+    try:
+      self.assertRaises(IOError, viewer.append_bundle, self.playground,
+                        self.write("b.jpg", "b" * 1000, 1000))
+    finally:
+      viewer.ChecksumReader = saved
+    self.assertEqual(viewer.bundle, None)
+    viewer.append_bundle(self.playground, self.write("c.jpg", "c", 1000))
+    self.assertEqual(self.members(), [("a.jpg", "a"), ("c.jpg", "c")])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -19,22 +19,47 @@ import glob
 import pygame
 import sys
 import os.path
-import urllib2
-import BaseHTTPServer
 import mmap
 import cStringIO
 import base64
-import subprocess
 import re
+import string
+import threading
+import itertools
+import time
 
 paused = False           # For image inspection
 image_number = None      # Scanimage starts counting at 1
 book_dimensions = None   # (top, bottom, side) in pixels
 fullscreen = True        # Easier to debug in a window
 suppressions = set()     # Pages we don't want to keep
+suppressions_stamp = None  # (mtime, size) of the suppressions file we read
+sequence_edits = []      # Sorted (frame, "blank" or "drop") misfeed fixes
+sequence_offsets = []    # (First page, frame minus page), from sequence_edits
+sequence_blanks = {}     # Page with no frame behind it -> frame it precedes
+frame_signatures = {}    # Frame number -> (dimensions, size, mtime)
 left_offset = 593        # Hardware sensor position in pixels
 right_offset = 150       # Hardware sensor position in pixels
 dpi = 300                # Hardware resolution
+memory_budget = int(os.environ.get("VIEWER_MEMORY_MB", 1024)) << 20  # Bytes
+memory_held = {}         # Name -> (bytes, priority, release or None, last use)
+memory_clock = itertools.count()  # Orders last use of memory_held entries
+surface_pool = {}        # Name -> reusable Surfaces, see pooled_surfaces()
+transform_cache = {}     # Name -> (source Surface, transformed Surface)
+remote_pages = {}        # (Path, ETag on server, height) -> Surface, review()
+bundle = None            # Book archive appended to as pages are finalized
+bundle_checksums = None  # Member name -> (sha256, size, mtime) in the bundle
+bundle_queue = None      # Files waiting for the background bundle writer
+bundle_error = None      # Why the last background append failed, if it did
+search_index = None      # Page number -> (hOCR stem, [(word, bbox), ...])
+search_words = {}        # Search key -> set of page numbers
+search_query = None      # What the user is typing in search mode
+search_hits = (None, []) # Left page number and search keys to highlight
+bibliography = None      # Filled in by a background lookup thread
+bibliography_cache = os.path.expanduser("~/.cheesegrater")  # By ISBN
+bibliography_url = os.environ.get("BIBLIOGRAPHY_URL", (
+    "http://books.google.com/books/download/"
+    "?vid=isbn%s&output=enw&source=cheese"))  # Point at a stub for testing
 
 def blue():
   """Original scansation blue, handed down from antiquity."""
@@ -116,12 +141,128 @@ def crop_to_full_coord(crop_coord, is_left):
     y += right_offset
   return x, y
 
+def surface_bytes(surface):
+  """How much memory the pixels of a surface occupy."""
+  return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+def memory_used():
+  """Sum of everything accounted for with hold_memory()."""
+  return sum(held[0] for held in memory_held.values())
+
+def hold_memory(name, nbytes, priority, release=None):
+  """Account for a big allocation, evicting others as needed.
+
+  Entries without a release function are pinned and never evicted.  Of
+  the rest, those of no higher priority go least recently used first.
+  Returns False if the budget is still exceeded, so the caller can degrade.
+  Nothing is evicted when that would not make enough room anyway.
+  """
+  memory_held[name] = (nbytes, priority, release, next(memory_clock))
+  victims = [(p, used, n) for n, (unused, p, r, used) in memory_held.items()
+             if r and p <= priority and n != name]
+  evictable = sum(memory_held[n][0] for unused, unused, n in victims)
+  if memory_used() - evictable > memory_budget:
+    return False
+  for unused, unused, victim in sorted(victims):
+    if memory_used() <= memory_budget:
+      break
+    release_memory(victim)
+  return memory_used() <= memory_budget
+
+def touch_memory(name):
+  """A cached allocation was just used, so evict it later rather than sooner."""
+  if name in memory_held:
+    memory_held[name] = memory_held[name][:3] + (next(memory_clock),)
+
+def release_memory(name):
+  """Forget about an allocation, letting its owner drop it."""
+  release = memory_held.pop(name, (0, 0, None, 0))[2]
+  if release:
+    release()
+
+def pooled_surface(name, size, priority, color=None, alpha=None):
+  """Reuse a scratch surface, only allocating when the size changes.
+
+  New surfaces are filled with color and given alpha, if supplied.
+  Returns None if the memory budget does not allow it.
+  """
+  surfaces = pooled_surfaces(name, size, priority, 1, color, alpha)
+  return surfaces and surfaces[0]
+
+def pooled_surfaces(name, size, priority, count, color=None, alpha=None):
+  """Like pooled_surface(), for a list of surfaces used together.
+
+  They are accounted as a single entry, so allocating one of them can
+  never evict another while the caller still holds it.
+  """
+  surfaces = surface_pool.get(name)
+  if surfaces is not None and surfaces[0].get_size() == size:
+    touch_memory(name)
+    return surfaces
+  release_memory(name)
+  if not hold_memory(name, count * size[0] * size[1] * 4, priority,
+                     lambda: surface_pool.pop(name, None)):
+    release_memory(name)
+    return None
+  surfaces = [pygame.Surface(size) for i in range(count)]
+  for surface in surfaces:
+    if color is not None:
+      surface.fill(color)
+    if alpha is not None:
+      surface.set_alpha(alpha)
+  surface_pool[name] = surfaces
+  return surfaces
+
+def flipped_surface(name, surface):
+  """Left to right mirror image, kept until release_memory(name).
+
+  Returns None if the memory budget does not allow it.
+  """
+  cached = transform_cache.get(name)
+  if cached is not None and cached[0] is surface:
+    touch_memory(name)
+    return cached[1]
+  release_memory(name)
+  if not hold_memory(name, surface_bytes(surface), 0,
+                     lambda: transform_cache.pop(name, None)):
+    release_memory(name)
+    return None
+  flipped = pygame.transform.flip(surface, True, False)
+  transform_cache[name] = (surface, flipped)
+  return flipped
+
+def shrink(surface, size):
+  """Smooth scaling reads every scan pixel; nearest neighbor only the
+  rows it samples, which keeps most of a big mmap out of memory."""
+  if memory_used() > memory_budget:
+    return pygame.transform.scale(surface, size)
+  return pygame.transform.smoothscale(surface, size)
+
 def process_image(h, filename, is_left):
   """Return both screen resolution and scan resolution images."""
   kSaddleHeight = 3600  # scan pixels
+  image, crop = crop_frame(filename, is_left)
+  w = image.get_width() * h // kSaddleHeight
+  scale = shrink(crop, (w, h))
+  if is_left:
+    scale = pygame.transform.flip(scale, True, False)
+    hold_memory("left scale", surface_bytes(scale), 2)
+  else:
+    hold_memory("right scale", surface_bytes(scale), 2)
+  return scale, crop
+
+def crop_frame(filename, is_left):
+  """Return a whole scan and the page part of it, straight from its mmap."""
+  kSaddleHeight = 3600  # scan pixels
   f = open(filename, "r+b")
   dimensions, headersize = read_ppm_header(f, filename)
   map = mmap.mmap(f.fileno(), 0)
+  f.close()
+  if is_left:
+    release_memory("flipped left page")
+    hold_memory("left page", len(map), 2)
+  else:
+    hold_memory("right page", len(map), 2)
   image = pygame.image.frombuffer(buffer(map, headersize), dimensions, 'RGB')
   unused, y = crop_to_full_coord((0, 0), is_left)
   if book_dimensions:
@@ -130,12 +271,48 @@ def process_image(h, filename, is_left):
   else:
     wh = (image.get_width(), kSaddleHeight)
   rect = pygame.Rect((0, y), wh)
-  crop = image.subsurface(rect)
-  w = image.get_width() * h // kSaddleHeight
-  scale = pygame.transform.smoothscale(crop, (w, h))
-  if is_left:
-    scale = pygame.transform.flip(scale, True, False)
-  return scale, crop
+  return image, image.subsurface(rect)
+
+def blank_image(scale, crop):
+  """Stand in for a frame the scanner never delivered."""
+  blank_scale = pygame.Surface(scale.get_size())
+  blank_scale.fill(blue())
+  blank_crop = pygame.Surface(crop.get_size())
+  blank_crop.fill(blue())
+  return blank_scale, blank_crop
+
+def frame_number(page):
+  """Which scanner frame shows a page, or None for an inserted blank."""
+  if page in sequence_blanks:
+    return None
+  offset = 0
+  for first, frame_offset in sequence_offsets:
+    if first <= page:
+      offset = frame_offset
+  return page + offset
+
+def page_number(frame):
+  """Which page a scanner frame shows, or None if it was dropped."""
+  n = len(sequence_edits)
+  for page in range(frame - n, frame + n + 1):
+    if frame_number(page) == frame:
+      return page
+  return None
+
+def frame_filename(playground, page):
+  """The scan behind a page, or None for an inserted blank."""
+  frame = frame_number(page)
+  if frame is None:
+    return None
+  return os.path.join(playground, '%06d.pnm' % frame)
+
+def pair_exists(playground, page):
+  """Is there a scan for either page of the pair?"""
+  for filename in (frame_filename(playground, page),
+                   frame_filename(playground, page + 1)):
+    if filename and os.path.exists(filename):
+      return True
+  return False
 
 def clip_image_number(playground):
   """Only show images that exist."""
@@ -143,11 +320,143 @@ def clip_image_number(playground):
   if image_number < 1:  # scanimage starts counting at 1
     image_number = 1
   while image_number > 1:
-    filename = os.path.join(playground, '%06d.pnm' % image_number)
-    if os.path.exists(filename):
+    if pair_exists(playground, image_number):
       break
     image_number -= 2
 
+def remap_sequence():
+  """Turn misfeed fixes into page to frame offsets.
+
+  Blanks before a frame come ahead of dropping it, which is also how
+  sequence_edits sorts since "blank" < "drop".
+  """
+  global sequence_offsets
+  global sequence_blanks
+  sequence_offsets, sequence_blanks = [], {}
+  offset = 0
+  for frame, edit in sequence_edits:
+    page = frame - offset
+    if edit == "drop":
+      offset += 1
+      sequence_offsets.append((page, offset))
+    else:
+      sequence_blanks[page] = frame
+      offset -= 1
+      sequence_offsets.append((page + 1, offset))
+
+def get_sequence(playground):
+  """Read misfeed fixes from file"""
+  try:
+    for line in open(os.path.join(playground, "sequence")).readlines():
+      if line[0] != "#" and line.strip():
+        frame, edit = line.strip().split(",")
+        sequence_edits.append((int(frame), edit))
+  except IOError:
+    pass
+  sequence_edits.sort()
+  remap_sequence()
+
+def set_sequence(playground, page, edit):
+  """Insert a blank before, or drop, the frame shown as page, persistently.
+
+  On a blank page either edit removes the blank.  Inserting before a
+  page whose previous frame was dropped brings that frame back instead.
+  Suppressions follow the frames they were made on.
+  """
+  get_suppressions(playground)
+  moved = {}
+  for left in suppressions:
+    if left + 1 >= page:
+      moved[left] = (frame_number(left), frame_number(left + 1))
+  files = glob.glob(os.path.join(playground, '*-*.jpg')) + \
+      glob.glob(os.path.join(playground, '*-*.html'))
+  shown = {}
+  for file in files:
+    number = int(os.path.basename(file).split('-')[0])
+    if number >= page:
+      shown[number] = frame_number(number)
+  frame = frame_number(page)
+  if frame is None:
+    sequence_edits.remove((sequence_blanks[page], "blank"))
+  elif edit == "blank" and (frame - 1, "drop") in sequence_edits:
+    sequence_edits.remove((frame - 1, "drop"))
+  else:
+    sequence_edits.append((frame, edit))
+    sequence_edits.sort()
+  remap_sequence()
+  f = open(os.path.join(playground, "sequence"), "wb")
+  f.write("#Misfeed fixes as frame number,drop or frame number,blank\n")
+  for frame, edit in sequence_edits:
+    f.write("%d,%s\n" % (frame, edit))
+  f.close()
+  if moved:
+    for left, frames in moved.items():
+      suppressions.discard(left)
+      for frame in frames:
+        moved_page = frame and page_number(frame)
+        if moved_page:
+          suppressions.add(moved_page - 1 + moved_page % 2)  # left page
+          break
+    write_suppressions(playground)
+  changed = set(number for number in shown
+                if frame_number(number) != shown[number])
+  for file in files:
+    if int(os.path.basename(file).split('-')[0]) in changed:
+      os.remove(file)  # Another frame now, or the other side; see recrop()
+  forget_search_pages(playground, changed)
+
+def frame_signature(playground, frame):
+  """Cheap facts to compare frames by: dimensions, size and write time."""
+  filename = os.path.join(playground, '%06d.pnm' % frame)
+  try:
+    stat = os.stat(filename)
+  except OSError:
+    return None
+  cached = frame_signatures.get(frame)
+  if cached and cached[1:] == (stat.st_size, stat.st_mtime):
+    return cached
+  try:
+    f = open(filename, "rb")
+    dimensions, headersize = read_ppm_header(f, filename)
+    f.close()
+  except (IOError, TypeError, ValueError):
+    return None
+  frame_signatures[frame] = (dimensions, stat.st_size, stat.st_mtime)
+  return frame_signatures[frame]
+
+def check_pair(playground, page):
+  """Say why a pair looks like a misfeed, or nothing if it looks fine.
+
+  Both sides of a sheet have the same dimensions and are written back
+  to back, so they should be closer in time than to the next sheet.
+  """
+  a, b = frame_number(page), frame_number(page + 1)
+  if a is None or b is None:
+    return ""
+  sig_a, sig_b = frame_signature(playground, a), frame_signature(playground, b)
+  if sig_a is None or sig_b is None:
+    later = os.path.join(playground, '%06d.pnm' % (max(a, b) + 1))
+    if os.path.exists(later):
+      return "GAP"
+    return ""
+  if sig_a[0] != sig_b[0]:
+    return "MISMATCH"
+  c = frame_number(page + 2)
+  sig_c = c and frame_signature(playground, c)
+  if sig_c and sig_b[2] - sig_a[2] > sig_c[2] - sig_b[2]:
+    return "MISFEED?"
+  return ""
+
+def next_misfeed(playground):
+  """Jump to the next pair that looks out of sync."""
+  global image_number
+  page = image_number + 2
+  while pair_exists(playground, page):
+    if check_pair(playground, page):
+      image_number = page
+      return
+    page += 2
+
 def get_book_dimensions(playground):
   """User saved book dimensions in some earlier run."""
   global book_dimensions
@@ -199,7 +508,15 @@ def zoom(screen, click, scale_a, scale_b, crop_a, crop_b):
   dst = (click[0] - size, click[1] - size)
   rect = pygame.Rect((coord[0] - size, coord[1] - size), (2 * size, 2 * size))
   if is_left:
-    tmp = pygame.Surface((2 * size, 2 * size))
+    flipped = flipped_surface("flipped left page", crop)
+    if flipped is not None:
+      rect.left = crop.get_width() - rect.right
+      screen.blit(flipped, dst, rect)
+      return
+    tmp = pooled_surface("zoom", (2 * size, 2 * size), 1)
+    if tmp is None:
+      tmp = pygame.Surface((2 * size, 2 * size))
+    tmp.fill((0, 0, 0))  # Past the page edge, don't show the last zoom
     tmp.blit(crop, (0,0), rect)
     tmp2 = pygame.transform.flip(tmp, True, False)
     screen.blit(tmp2, dst)
@@ -212,11 +529,17 @@ def draw(screen, image_number, scale_a, scale_b, paused):
   render_text(screen, "%s" % str(image_number).ljust(4), "upperleft")
   render_text(screen, "%s" % str(image_number + 1).rjust(4), "upperright")
   epsilon = get_epsilon(screen)
-  render_text(screen, "\n     ", "upperleft")
+  render_text(screen, "\n     \n      ", "upperleft")
   screen.blit(scale_a, (w2 - scale_a.get_width() - epsilon, 0))
   screen.blit(scale_b, (w2 + epsilon, 0))
   if paused:
     render_text(screen, "\nPAUSE", "upperleft")
+  if memory_used() > memory_budget:
+    render_text(screen, "\n\nLOWMEM", "upperleft")  # Degraded, see shrink()
+  if bundle_error:
+    render_text(screen, "\n\n%s" % bundle_error, "upperright")
+  if search_query is not None:
+    render_text(screen, "\n\n\n\n/%s_ " % search_query, "upperleft")
 
 def create_new_pdf(playground, width, height):
   import reportlab.rl_config
@@ -232,8 +555,10 @@ def export_pdf(playground, screen):
   """Create a PDF file fit for human consumption"""
   if book_dimensions == None:
     return
+  get_suppressions(playground)
   width = book_dimensions[2] * 72 / dpi
   height = (book_dimensions[1] - book_dimensions[0]) * 72 / dpi
+  recrop(playground, screen)
   pdf = create_new_pdf(playground, width, height)
   jpegs = glob.glob(os.path.join(playground, '*.jpg'))
   jpegs.sort(reverse=True)  # Switch to reading order
@@ -249,35 +574,46 @@ def export_pdf(playground, screen):
     add_text_layer(pdf, jpeg, height)
     pdf.showPage()
   pdf.save()
+  bundle_file(playground, os.path.join(playground, "book.pdf"))
   render_text(screen, " " * len(msg), "upperright")
 
-def add_text_layer(pdf, jpeg, height):
-  """Draw an invisible text layer for OCR data"""
+def read_hocr(hocrfile):
+  """Return OCR lines as (bbox, [(word, bbox), ...]), or None if missing"""
   from xml.etree.ElementTree import ElementTree, ParseError
   p = re.compile('bbox((\s+\d+){4})')
-  hocrfile = os.path.splitext(jpeg)[0] + ".html"
   hocr = ElementTree()
   try:
     hocr.parse(hocrfile)
   except ParseError:
     print("Parse error for %s" % hocrfile)  # Tesseract bug fixed Aug 16, 2012
-    return
+    return []  # No text, but no point in reading it again either
   except IOError:
-    return  # Tesseract not installed; user doesn't want OCR
+    return None  # Tesseract not installed; user doesn't want OCR
+  lines = []
   for line in hocr.findall(".//%sspan"%('')):
     if line.attrib['class'] != 'ocr_line':
       continue
     coords = p.search(line.attrib['title']).group(1).split()
-    # Heuristic - we assume 30% of line bounding box is descenders
-    b = float(coords[3]) - 0.3 * (float(coords[3]) - float(coords[1]))
-    base = height - b * 72 / dpi
+    words = []
     for word in line:
       if word.attrib['class'] != 'ocr_word' or word.text is None:
         continue
-      default_width = pdf.stringWidth(word.text.strip(), 'invisible', 8)
+      box = p.search(word.attrib['title']).group(1).split()
+      words.append((word.text.strip(), [int(x) for x in box]))
+    lines.append(([int(x) for x in coords], words))
+  return lines
+
+def add_text_layer(pdf, jpeg, height):
+  """Draw an invisible text layer for OCR data"""
+  hocrfile = os.path.splitext(jpeg)[0] + ".html"
+  for coords, words in read_hocr(hocrfile) or []:
+    # Heuristic - we assume 30% of line bounding box is descenders
+    b = float(coords[3]) - 0.3 * (float(coords[3]) - float(coords[1]))
+    base = height - b * 72 / dpi
+    for word, coords in words:
+      default_width = pdf.stringWidth(word, 'invisible', 8)
       if default_width <= 0:
         continue
-      coords = p.search(word.attrib['title']).group(1).split()
       left = float(coords[0]) * 72 / dpi
       right = float(coords[2]) * 72 / dpi
       text = pdf.beginText()
@@ -285,17 +621,181 @@ def add_text_layer(pdf, jpeg, height):
       text.setFont('invisible', 8)
       text.setTextOrigin(left, base)
       text.setHorizScale(100.0 * (right - left) / default_width)
-      text.textLine(word.text.strip())
+      text.textLine(word)
       pdf.drawText(text)
 
+def search_key(word):
+  """Searches ignore case and surrounding punctuation."""
+  return word.strip(string.punctuation).lower()
+
+def index_page(number, stem, words):
+  """Make a page findable, forgetting whatever it said before."""
+  if number in search_index:
+    for word, bbox in search_index[number][1]:
+      search_words.get(search_key(word), set()).discard(number)
+  search_index[number] = (stem, words)
+  for word, bbox in words:
+    search_words.setdefault(search_key(word), set()).add(number)
+
+def get_search_index(playground):
+  """Read the OCR word index; later entries for a page replace earlier."""
+  global search_index
+  search_index = {}
+  stem_pattern = re.compile(r'^\d{6}(-\d+)*$')
+  try:
+    stem, words = None, []
+    for line in open(os.path.join(playground, "search_index")).readlines():
+      if not line.endswith("\n"):
+        continue  # Cut short by a crash while appending
+      if line[0] == "=":
+        if stem:
+          index_page(int(stem.split("-")[0]), stem, words)
+        stem, words = line[1:-1], []
+        if not stem_pattern.match(stem):
+          stem = None  # Skip its words too
+      elif line[0] != "#" and stem:
+        fields = line.split(None, 4)
+        try:
+          words.append((fields[4][:-1], [int(x) for x in fields[0:4]]))
+        except (IndexError, ValueError):
+          pass  # Two lines run together after a crash
+    if stem:
+      index_page(int(stem.split("-")[0]), stem, words)
+  except IOError:
+    pass
+
+def append_search_index(playground):
+  """Open the index for appending, on a fresh line even after a crash."""
+  f = open(os.path.join(playground, "search_index"), "a+b")
+  f.seek(0, os.SEEK_END)
+  if f.tell() > 0:
+    f.seek(-1, os.SEEK_END)
+    if f.read(1) != "\n":
+      f.seek(0, os.SEEK_END)
+      f.write("\n")
+  return f
+
+def forget_search_pages(playground, numbers):
+  """These pages show other frames now; reindex them later."""
+  if search_index is None:
+    get_search_index(playground)
+  f = append_search_index(playground)
+  for number in sorted(search_index):
+    if number in numbers:
+      index_page(number, "%06d" % number, [])
+      f.write("=%06d\n" % number)
+  f.close()
+
+def update_search_index(playground, hocrfiles=None):
+  """Index hOCR files we haven't seen yet, appending them to disk."""
+  if search_index is None:
+    get_search_index(playground)
+  if hocrfiles is None:
+    hocrfiles = glob.glob(os.path.join(playground, '*.html'))
+  f = None
+  for hocrfile in sorted(hocrfiles):
+    stem = os.path.splitext(os.path.basename(hocrfile))[0]
+    number = int(stem.split("-")[0])
+    if number in search_index and search_index[number][0] == stem:
+      continue
+    lines = read_hocr(hocrfile)
+    if lines is None:
+      continue  # Try again after tesseract writes it
+    words = [(word.encode("utf-8"), bbox) for unused, line in lines
+             for word, bbox in line if len(word.split()) == 1]
+    index_page(number, stem, words)
+    if not f:
+      f = append_search_index(playground)
+    f.write("=%s\n" % stem)
+    for word, bbox in words:
+      f.write("%d %d %d %d %s\n" % (bbox[0], bbox[1], bbox[2], bbox[3], word))
+  if f:
+    f.close()
+
+def ocr_finished(playground, hocrfile):
+  """A tesseract job is done, so its hOCR can be indexed and bundled."""
+  update_search_index(playground, [hocrfile])
+  bundle_file(playground, hocrfile)
+
+def find_pages(query):
+  """Page numbers containing every word of the query."""
+  keys = [search_key(word) for word in query.split()]
+  keys = [key for key in keys if key]
+  if not keys:
+    return set(), keys
+  pages = set(search_words.get(keys[0], set()))
+  for key in keys[1:]:
+    pages &= search_words.get(key, set())
+  return pages, keys
+
+def search(playground, screen, query):
+  """Jump to the next pair after this one with all words of the query."""
+  global image_number
+  global paused
+  global search_hits
+  update_search_index(playground)
+  pages, keys = find_pages(query.encode("utf-8"))
+  if not pages:
+    msg = "Not found: %s" % query
+    render_text(screen, msg, "upperright")
+    pygame.time.wait(2000)
+    render_text(screen, " " * len(msg), "upperright")
+    return
+  later = [number for number in pages if number > image_number + 1]
+  number = min(later or pages)  # Wrap around to the front of the book
+  image_number = number - 1 + number % 2  # left page
+  search_hits = (image_number, keys)
+  paused = True
+
+def highlight_search(screen, image_number, scale_a, scale_b, crop_a, crop_b):
+  """Outline the words we searched for, using their OCR bounding boxes."""
+  if search_hits[0] != image_number or not search_index:
+    return
+  w2 = screen.get_width() // 2
+  epsilon = get_epsilon(screen)
+  pages = ((image_number, w2 - epsilon - scale_a.get_width(), scale_a, crop_a),
+           (image_number + 1, w2 + epsilon, scale_b, crop_b))
+  for number, x0, scale, crop in pages:
+    sx = float(scale.get_width()) / crop.get_width()
+    sy = float(scale.get_height()) / crop.get_height()
+    for word, bbox in search_index.get(number, (None, []))[1]:
+      if search_key(word) not in search_hits[1]:
+        continue
+      rect = pygame.Rect(x0 + bbox[0] * sx, bbox[1] * sy,
+                         (bbox[2] - bbox[0]) * sx, (bbox[3] - bbox[1]) * sy)
+      pygame.draw.rect(screen, pygame.Color('yellow'), rect.inflate(6, 6), 2)
+
 def save_jpeg(screen, crop_a, crop_b, playground, image_number):
   """Save cropped images in reading order."""
-  a = pygame.transform.flip(crop_a, True, False)
-  p1 = write_jpeg(screen, playground, a, image_number)
-  p2 = write_jpeg(screen, playground, crop_b, image_number + 1)
+  p1, p2 = None, None
+  if frame_number(image_number) is not None:
+    a = flipped_surface("flipped left page", crop_a)
+    if a is None:
+      a = pygame.transform.flip(crop_a, True, False)
+    p1 = write_jpeg(screen, playground, a, image_number)
+  if frame_number(image_number + 1) is not None:
+    p2 = write_jpeg(screen, playground, crop_b, image_number + 1)
   return (p1, p2)
 
-def write_jpeg(screen, playground, img, number):
+def recrop(playground, screen):
+  """Write any page JPEGs missing after a misfeed fix, leaving OCR for
+  when they are viewed since a tesseract per page would swamp us."""
+  frames = glob.glob(os.path.join(playground, '[0-9]' * 6 + '.pnm'))
+  for frame in sorted(int(os.path.basename(x)[:6]) for x in frames):
+    number = page_number(frame)
+    if number is None or \
+          glob.glob(os.path.join(playground, '%06d-*.jpg' % number)):
+      continue
+    msg = "Cropping page %d" % number
+    render_text(screen, msg, "upperright")
+    is_left = number % 2 == 1
+    unused, crop = crop_frame(frame_filename(playground, number), is_left)
+    if is_left:
+      crop = pygame.transform.flip(crop, True, False)
+    write_jpeg(screen, playground, crop, number, ocr=False)
+    render_text(screen, " " * len(msg), "upperright")
+
+def write_jpeg(screen, playground, img, number, ocr=True):
   """Write JPEG image if not already there, plus remove any old cruft"""
   if book_dimensions:
     d = book_dimensions
@@ -310,14 +810,21 @@ def write_jpeg(screen, playground, img, number):
   jpeg = os.path.join(playground, stem + ".jpg")
   if not os.path.exists(jpeg):
     pygame.image.save(img, jpeg)
+  bundle_file(playground, jpeg)
+  bundle_file(playground, frame_filename(playground, number))
   p = None
   hocr = os.path.join(playground, stem)
   if os.path.exists(hocr + ".html"):
+    bundle_file(playground, hocr + ".html")
     msg = "\n\n\n   "
+  elif not ocr:
+    return None
   else:
     msg = "\n\n\nOCR"
+    import subprocess
     try:
       p = subprocess.Popen(['tesseract', jpeg, hocr, 'hocr'])
+      p.hocrfile = hocr + ".html"  # For ocr_finished()
     except OSError:
       pass  # Tesseract not installed; user doesn't want OCR
   if number % 2 == 0:
@@ -326,11 +833,169 @@ def write_jpeg(screen, playground, img, number):
     render_text(screen, msg,  "upperright")
   return p
 
+class ChecksumReader(object):
+  """File wrapper that hashes whatever tarfile reads through it."""
+
+  def __init__(self, filename):
+    import hashlib
+    self.f = open(filename, "rb")
+    self.sha256 = hashlib.sha256()
+
+  def read(self, size=-1):
+    data = self.f.read(size)
+    self.sha256.update(data)
+    return data
+
+  def close(self):
+    self.f.close()
+
+def get_bundle_checksums(playground):
+  """Read what is already in the bundle, one line per appended file."""
+  global bundle_checksums
+  bundle_checksums = {}
+  try:
+    for line in open(os.path.join(playground, "bundle_checksums")).readlines():
+      if line[0] != "#":
+        sha256, size, mtime, name = line.rstrip("\n").split(" ", 3)
+        bundle_checksums[name] = (sha256, int(size), float(mtime))
+  except IOError:
+    pass
+
+def bundle_file(playground, filename):
+  """Queue a finished file for the book bundle.
+
+  Copying a raw scan into the bundle takes a while, so the work is done
+  by a background writer thread and the viewer stays responsive.
+  """
+  global bundle_queue
+  if bundle_queue is None:
+    import Queue
+    bundle_queue = Queue.Queue()
+    writer = threading.Thread(target=bundle_writer, args=(bundle_queue,))
+    writer.daemon = True
+    writer.start()
+  bundle_queue.put((playground, filename))
+
+def bundle_writer(queue):
+  """Append queued files to the bundle, forever, whatever goes wrong."""
+  global bundle_error
+  while True:
+    playground, filename = queue.get()
+    try:
+      append_bundle(playground, filename)
+      bundle_error = None
+    except Exception, e:
+      bundle_error = "Bundle: %s" % e  # Shown by draw()
+    finally:
+      queue.task_done()
+
+def finish_bundle():
+  """Wait for the background writer to catch up."""
+  if bundle_queue is not None:
+    bundle_queue.join()
+
+def append_bundle(playground, filename, force=False):
+  """Append a file to the book bundle, checksumming on the way.
+
+  The bundle is an uncompressed tar file that only ever grows; a file
+  that changes is appended again and the manifest points at the latest.
+  Unless forced, files whose size and mtime match the bundle are skipped.
+  """
+  global bundle
+  import tarfile
+  try:
+    stat = os.stat(filename)
+  except OSError:
+    return
+  name = os.path.basename(filename)
+  if bundle_checksums is None:
+    get_bundle_checksums(playground)
+  if not force and bundle_checksums.get(name, (None,))[1:] == (stat.st_size,
+                                                               stat.st_mtime):
+    return
+  if bundle is None:
+    bundle = tarfile.open(os.path.join(playground, "bundle.tar"), "a")
+  info = bundle.gettarinfo(filename, name)
+  reader = ChecksumReader(filename)
+  offset = bundle.offset
+  try:
+    bundle.addfile(info, reader)
+    bundle.fileobj.flush()
+  except Exception:
+    discard_bundle(offset)
+    raise
+  finally:
+    reader.close()
+  bundle_checksums[name] = (reader.sha256.hexdigest(), info.size,
+                            stat.st_mtime)
+  f = open(os.path.join(playground, "bundle_checksums"), "ab")
+  f.write("%s %d %r %s\n" % (bundle_checksums[name] + (name,)))
+  f.close()
+
+def discard_bundle(offset):
+  """Cut a half written member off the bundle and close it, so the next
+  append reopens it cleanly."""
+  global bundle
+  try:
+    bundle.fileobj.seek(offset)
+    bundle.fileobj.truncate()
+    bundle.offset = offset
+    bundle.close()
+  finally:
+    bundle = None
+
+def close_bundle(playground, screen):
+  """Add state files and a manifest, without rereading any page images.
+
+  The state files are small and may be rewritten within the same
+  second, so they are always appended again.
+  """
+  global bundle
+  import tarfile
+  render_text(screen, "Bundling", "upperright")
+  finish_bundle()
+  try:
+    for name in ("book_dimensions", "suppressions", "sequence",
+                 "search_index"):
+      append_bundle(playground, os.path.join(playground, name), force=True)
+    append_bundle(playground, os.path.join(playground, "book.pdf"))
+    if bundle_checksums is None:
+      get_bundle_checksums(playground)
+    if bundle is None:
+      bundle = tarfile.open(os.path.join(playground, "bundle.tar"), "a")
+    manifest = ""
+    for name in sorted(bundle_checksums):
+      if os.path.exists(os.path.join(playground, name)):
+        manifest += "%s  %s\n" % (bundle_checksums[name][0], name)
+    info = tarfile.TarInfo("MANIFEST")
+    info.size = len(manifest)
+    info.mtime = time.time()
+    offset = bundle.offset
+    try:
+      bundle.addfile(info, cStringIO.StringIO(manifest))
+    except Exception:
+      discard_bundle(offset)
+      raise
+    bundle.close()
+    bundle = None
+    msg = "Bundled %d files" % manifest.count("\n")
+  except (tarfile.TarError, IOError, OSError), e:
+    msg = "Bundle: %s" % e
+  render_text(screen, msg, "upperright")
+  pygame.time.wait(2000)
+  render_text(screen, " " * len(msg), "upperright")
+
 def get_bibliography(barcode):
   """Hit up Google Books for bibliographic data. Thanks, Leonid."""
   if barcode[0:3] == "978":
-    url = ("http://books.google.com/books/download/"
-           "?vid=isbn%s&output=enw&source=cheese" % barcode[0:13])
+    cache = os.path.join(bibliography_cache, barcode[0:13])
+    try:
+      return open(cache).read()
+    except IOError:
+      pass
+    import urllib2
+    import BaseHTTPServer
+    url = bibliography_url % barcode[0:13]
     try:
       bib = urllib2.urlopen(url, None, 2).read()
     except urllib2.URLError, e:
@@ -341,16 +1006,34 @@ def get_bibliography(barcode):
         excuse += BaseHTTPServer.BaseHTTPRequestHandler.responses[e.code][0]
       return "Error looking up barcode: %s\n\n%s" % (barcode.split("_")[0],
                                                      excuse)
+    try:
+      if not os.path.isdir(bibliography_cache):
+        os.makedirs(bibliography_cache)
+      f = open(cache, "wb")
+      f.write(bib)
+      f.close()
+    except (IOError, OSError):
+      pass  # Lookup worked, so no point in complaining
     return bib
   return "Unknown Barcode: %s" % barcode.split("_")[0]
 
+def lookup_bibliography(barcode):
+  """Runs in the background so the first pages show up right away."""
+  global bibliography
+  try:
+    bibliography = get_bibliography(barcode)
+  except Exception, e:  # Timeouts, HTTP trouble, a bad BIBLIOGRAPHY_URL...
+    bibliography = "Error looking up barcode: %s\n\n%s" % (
+        barcode.split("_")[0], e)
+
 def splashscreen(screen, barcode):
   """Like opening credits in a movie, but more useful."""
   clearscreen(screen)
-  render_text(screen, "Looking up barcode: %s" % barcode.split("_")[0],
-              "upperleft")
-  clearscreen(screen)
-  render_text(screen, get_bibliography(barcode), "upperleft")
+  if bibliography is None:
+    render_text(screen, "Looking up barcode: %s" % barcode.split("_")[0],
+                "upperleft")
+  else:
+    render_text(screen, bibliography, "upperleft")
   pygame.display.update()
   render_text(screen, ("\n\n\n\n\n\n\n\n\n\n"
                        "H,?                  = help\n"
@@ -361,38 +1044,75 @@ def splashscreen(screen, barcode):
                        "S                    = screenshot\n"
                        "Q,ESC                = quit\n"
                        "\n"
+                       "/                    = search\n"
                        "E                    = export to pdf\n"
+                       "A                    = archive bundle\n"
                        "DELETE,BACKSPACE     = delete\n"
                        "U                    = uncrop\n"
+                       "I,X                  = insert blank, drop frame\n"
+                       "N                    = next misfeed\n"
                        "F11,F                = fullscreen\n"
                        "P,SPACE              = pause\n"
                        ), "upperleft")
   clearscreen(screen)
-  pygame.time.wait(2000)
 
 def get_suppressions(playground):
-  """Read list of suppressed images from file"""
+  """Read list of suppressed images from file, if changed since last time.
+
+  Remote reviewers change the file through serve(), so check before use.
+  """
   global suppressions
+  global suppressions_stamp
+  filename = os.path.join(playground, "suppressions")
   try:
-    for line in open(os.path.join(playground, "suppressions")).readlines():
-      if line[0] != "#":
+    stat = os.stat(filename)
+    if (stat.st_mtime, stat.st_size) == suppressions_stamp:
+      return
+    suppressions_stamp = (stat.st_mtime, stat.st_size)
+    suppressions = set()
+    for line in open(filename).readlines():
+      if line[0] != "#" and line.strip():
         suppressions = set([int(x) for x in line.split(",")])
-  except IOError:
+  except (IOError, OSError):
     pass
 
-def set_suppressions(playground, image_number):
-  """Toggle supression for the supplied image pair, persistantly"""
-  global suppressions
-  if image_number in suppressions:
-    suppressions.remove(image_number)
-  else:
-    suppressions.add(image_number)
+def write_suppressions(playground):
+  """Save suppressions, remembering that we have seen our own change."""
+  global suppressions_stamp
   filename = os.path.join(playground, "suppressions")
   f = open(filename, "wb")
   f.write("#Suppressed image pairs indicated by left image number\n")
   f.write(str(suppressions).strip('set([])'))
   f.write("\n");
   f.close()
+  stat = os.stat(filename)
+  suppressions_stamp = (stat.st_mtime, stat.st_size)
+
+def set_suppressions(playground, image_number, suppressed=None):
+  """Toggle, or set, supression for the supplied image pair, persistantly"""
+  get_suppressions(playground)
+  if suppressed is None:
+    suppressed = image_number not in suppressions
+  if suppressed:
+    suppressions.add(image_number)
+  else:
+    suppressions.discard(image_number)
+  write_suppressions(playground)
+
+def handle_search_key(screen, event, playground):
+  """Collect a search query one keystroke at a time."""
+  global search_query
+  if event.key == pygame.K_ESCAPE:
+    search_query = None
+  elif event.key == pygame.K_RETURN or event.key == pygame.K_KP_ENTER:
+    search(playground, screen, search_query)
+    search_query = None
+  elif event.key == pygame.K_BACKSPACE:
+    search_query = search_query[:-1]
+  elif event.unicode and event.unicode >= u" ":
+    search_query += event.unicode
+  if search_query is not None:
+    render_text(screen, "\n\n\n\n/%s_ " % search_query, "upperleft")
 
 def handle_key_event(screen, event, playground, barcode, mosaic_click,
                      fullsize):
@@ -400,14 +1120,21 @@ def handle_key_event(screen, event, playground, barcode, mosaic_click,
   global image_number
   global paused
   global fullscreen
+  global search_query
   newscreen = None
   if event.key == pygame.K_ESCAPE or event.key == pygame.K_q:
+    finish_bundle()
     pygame.quit()
     sys.exit()
   elif event.key == pygame.K_SPACE or event.key == pygame.K_p:
     paused = not paused
   elif event.key == pygame.K_e:
     export_pdf(playground, screen)
+  elif event.key == pygame.K_a:
+    close_bundle(playground, screen)
+  elif event.unicode == u"/":  # Shifted, the same key is help
+    search_query = u""
+    paused = True
   elif event.key == pygame.K_DELETE or event.key == pygame.K_BACKSPACE:
     set_suppressions(playground, image_number)
   elif event.key == pygame.K_F11 or event.key == pygame.K_f:
@@ -433,20 +1160,36 @@ def handle_key_event(screen, event, playground, barcode, mosaic_click,
   elif event.key == pygame.K_END:
     pnms = glob.glob(os.path.join(playground, '*.pnm'))
     pnms.sort(reverse=True)
-    candidate = int(os.path.splitext(os.path.basename(pnms[0]))[0])
+    for pnm in pnms:
+      candidate = page_number(int(os.path.splitext(os.path.basename(pnm))[0]))
+      if candidate is not None:
+        break
     image_number = candidate - 1 + candidate % 2  # left page
     paused = True
   elif event.key == pygame.K_u:
     unset_book_dimensions(playground)
+  elif event.key == pygame.K_i or event.key == pygame.K_x:
+    page = image_number
+    if event.mod & pygame.KMOD_SHIFT:
+      page += 1
+    if event.key == pygame.K_i:
+      set_sequence(playground, page, "blank")
+    else:
+      set_sequence(playground, page, "drop")
+    paused = True
+  elif event.key == pygame.K_n:
+    next_misfeed(playground)
+    paused = True
   elif event.key == pygame.K_s:
     filename = "screenshot-" + barcode + "-" + str(image_number) + ".jpg"
     pygame.image.save(screen, filename);
     render_text(screen, filename, "upperright")
     pygame.time.wait(2000)
     render_text(screen, " " * len(filename), "upperright")
-  elif event.key == pygame.K_h or event.key == pygame.K_QUESTION:
+  elif event.key == pygame.K_h or event.key == pygame.K_QUESTION or \
+        event.unicode == u"?":
     splashscreen(screen, barcode)
-    pygame.time.wait(3000)
+    pygame.time.wait(5000)
   clip_image_number(playground)
   if mosaic_click:
     clearscreen(screen)
@@ -454,12 +1197,25 @@ def handle_key_event(screen, event, playground, barcode, mosaic_click,
 
 def render(playground, screen, paused, image_number):
   """Calculate and draw entire screen, including book images."""
-  filename_a = os.path.join(playground, '%06d.pnm' % image_number)
-  filename_b = os.path.join(playground, '%06d.pnm' % (image_number + 1))
+  get_suppressions(playground)
+  filename_a = frame_filename(playground, image_number)
+  filename_b = frame_filename(playground, image_number + 1)
   h = screen.get_height()
-  scale_a, crop_a = process_image(h, filename_a, True)
-  scale_b, crop_b = process_image(h, filename_b, False)
+  if filename_a is None and filename_b is None:
+    raise IOError("Nothing but blanks at %d" % image_number)
+  if filename_a is None:
+    scale_b, crop_b = process_image(h, filename_b, False)
+    scale_a, crop_a = blank_image(scale_b, crop_b)
+  elif filename_b is None:
+    scale_a, crop_a = process_image(h, filename_a, True)
+    scale_b, crop_b = blank_image(scale_a, crop_a)
+  else:
+    scale_a, crop_a = process_image(h, filename_a, True)
+    scale_b, crop_b = process_image(h, filename_b, False)
   draw(screen, image_number, scale_a, scale_b, paused)
+  render_text(screen, "\n%s" % check_pair(playground, image_number).rjust(8),
+              "upperright")
+  highlight_search(screen, image_number, scale_a, scale_b, crop_a, crop_b)
   pygame.display.set_caption("%d %s" %
                              (image_number, os.path.basename(playground)))
   pygame.display.update()
@@ -484,13 +1240,13 @@ def navigate_mosaic(playground, screen, click):
     return
   x, y = click[0] // size[0], click[1] // size[1]
   candidate = start + 2 * (columns * y + x)
-  filename = os.path.join(playground, '%06d.pnm' % candidate)
-  if os.path.exists(filename):
+  if pair_exists(playground, candidate):
     image_number = candidate
 
 def render_mosaic(screen, playground, click, scale_size, crop_size,
                   image_number):
   """Useful for seeing lots of page numbers at once."""
+  get_suppressions(playground)
   crop_coord, is_left = scale_to_crop_coord(click, scale_size,
                                             crop_size, get_epsilon(screen))
   full_coord = crop_to_full_coord(crop_coord, is_left)
@@ -500,7 +1256,9 @@ def render_mosaic(screen, playground, click, scale_size, crop_size,
   for i in range(start, start + windowsize, 2):
     x = ((i - start) // 2) % columns
     y = ((i - start) // 2) // columns
-    filename = os.path.join(playground, '%06d.pnm' % i)
+    filename = frame_filename(playground, i)
+    if filename is None:
+      continue  # Inserted blank
     if not os.path.exists(filename):
       break
     f = open(filename, "r+b")
@@ -510,7 +1268,7 @@ def render_mosaic(screen, playground, click, scale_size, crop_size,
     src = full_coord[0] - 3 * size[0] // 2, full_coord[1] - 3 * size[1] // 2
     rect = pygame.Rect(src, (size[0] * 3, size[1] * 3))
     crop = image.subsurface(rect)
-    scale = pygame.transform.smoothscale(crop, size)
+    scale = shrink(crop, size)
     if is_left:
       scale = pygame.transform.flip(scale, True, False)
     dst = (size[0] * x, size[1] * y)
@@ -521,10 +1279,10 @@ def render_mosaic(screen, playground, click, scale_size, crop_size,
       left_image_number =  i - 1
     screen.blit(scale, dst)
     if left_image_number in suppressions:
-      red = pygame.Surface(scale.get_size())
-      red.fill(pygame.Color('red'))
-      red.set_alpha(128)
-      screen.blit(red, dst)
+      red = pooled_surface("suppressed tile", scale.get_size(), 1,
+                           pygame.Color('red'), 128)
+      if red is not None:
+        screen.blit(red, dst)
     map.close()
     f.close()
     pygame.display.update(dirty)
@@ -563,6 +1321,7 @@ def main(argv1):
   last_drawn_image_number = 0
   get_book_dimensions(playground)
   get_suppressions(playground)
+  get_sequence(playground)
   try:
     beep = get_beep()
   except:
@@ -571,13 +1330,14 @@ def main(argv1):
   set_pygame_window(fullsize, fullscreen)
   screen = pygame.display.get_surface()
   pygame.display.set_caption("%s" % os.path.basename(playground))
+  lookup = threading.Thread(target=lookup_bibliography, args=(barcode,))
+  lookup.daemon = True
+  lookup.start()
   splashscreen(screen, barcode)
+  splashed = None
   scale_a = None  # prevent crash if keypress during opening splashscreen
   image_number = 1
   pygame.time.set_timer(pygame.USEREVENT, 50)
-  shadow = pygame.Surface(screen.get_size())
-  shadow.set_alpha(128)
-  shadow.fill((0, 0, 0))
   mosaic_click = None  # Don't mode me in, bro!
   p1, p2 = None, None
   busy = False
@@ -590,10 +1350,18 @@ def main(argv1):
         if mosaic_click or book_dimensions:
           continue
         leftdownclick = event.pos
-        oldscreen = screen.copy()
-        shadowscreen = screen.copy()
-        shadowscreen.blit(shadow, (0, 0))
-        screen.blit(shadowscreen, (0, 0))
+        size = screen.get_size()
+        buffers = pooled_surfaces("drag", size, 1, 3)
+        if buffers is None:
+          oldscreen, shadowscreen = None, None  # Rubber band outline only
+        else:
+          shadow, oldscreen, shadowscreen = buffers
+          shadow.fill((0, 0, 0))
+          shadow.set_alpha(128)
+          oldscreen.blit(screen, (0, 0))
+          shadowscreen.blit(screen, (0, 0))
+          shadowscreen.blit(shadow, (0, 0))
+          screen.blit(shadowscreen, (0, 0))
         prevroi = pygame.Rect(event.pos, (0, 0))
         pygame.display.update()
       elif event.type == pygame.MOUSEMOTION and event.buttons[0] == 1:
@@ -604,8 +1372,13 @@ def main(argv1):
         roi = pygame.Rect(pos, (2 * x, abs(leftdownclick[1] - event.pos[1])))
         dirty = roi.union(prevroi)
         prevroi = roi.copy()
-        screen.blit(shadowscreen, dirty.topleft, area = dirty)
-        screen.blit(oldscreen, roi.topleft, area = roi)
+        if oldscreen is not None:
+          screen.blit(shadowscreen, dirty.topleft, area = dirty)
+          screen.blit(oldscreen, roi.topleft, area = roi)
+        else:
+          clearscreen(screen)
+          draw(screen, image_number, scale_a, scale_b, paused)
+          pygame.draw.rect(screen, (255, 255, 255), roi, 1)
         pygame.display.update(dirty)
       elif event.type == pygame.MOUSEBUTTONUP and event.button == 1:
         if mosaic_click:
@@ -613,7 +1386,7 @@ def main(argv1):
           last_drawn_image_number = None
           mosaic_click = None
         elif not book_dimensions:
-          oldscreen = None
+          oldscreen, shadowscreen = None, None
           leftclick = (leftdownclick, event.pos)
           set_book_dimensions(leftclick, get_epsilon(screen), crop_a.get_size(),
                               scale_a.get_size(), playground)
@@ -629,6 +1402,7 @@ def main(argv1):
         mosaic_click = None
         clearscreen(screen)
         draw(screen, image_number, scale_a, scale_b, paused)
+        highlight_search(screen, image_number, scale_a, scale_b, crop_a, crop_b)
         pygame.display.update()
         busy = False
       elif event.type == pygame.MOUSEBUTTONUP and event.button == 2:
@@ -644,8 +1418,15 @@ def main(argv1):
         paused = True
         busy = False
       elif event.type == pygame.QUIT:
+        finish_bundle()
         pygame.quit()
         sys.exit()
+      elif search_query is not None and event.type == pygame.KEYDOWN:
+        handle_search_key(screen, event, playground)
+        if search_query is None:
+          mosaic_click = None
+          clearscreen(screen)
+          last_drawn_image_number = None
       elif mosaic_click and \
             event.type == pygame.KEYDOWN and \
             (event.key == pygame.K_PAGEUP or event.key == pygame.K_PAGEDOWN):
@@ -677,11 +1458,13 @@ def main(argv1):
         if busy:
           continue
         if p1 and p1.poll() != None:
-          p1 = None
           render_text(screen, "\n\n\n   ", "upperleft")
+          ocr_finished(playground, p1.hocrfile)
+          p1 = None
         if p2 and p2.poll() != None:
-          p2 = None
           render_text(screen, "\n\n\n   ", "upperright")
+          ocr_finished(playground, p2.hocrfile)
+          p2 = None
         if not (paused or p1 or p2):
           image_number += 2
           clip_image_number(playground)
@@ -698,6 +1481,327 @@ def main(argv1):
           except IOError:
             pass
           pygame.event.clear(pygame.USEREVENT)
+        if last_drawn_image_number == 0 and bibliography != splashed:
+          splashed = bibliography  # Nothing scanned yet, so show what we got
+          splashscreen(screen, barcode)
+
+def book_json(playground):
+  """Everything a remote reviewer needs to know, besides the images."""
+  global book_dimensions
+  book_dimensions = None
+  get_book_dimensions(playground)
+  get_suppressions(playground)
+  jpegs = glob.glob(os.path.join(playground, '*.jpg'))
+  etags = {}
+  for jpeg in jpegs:
+    try:
+      etags[os.path.basename(jpeg)] = file_etag(os.stat(jpeg))
+    except OSError:
+      pass  # Removed by a misfeed fix while we looked
+  return {"barcode": os.path.basename(playground),
+          "dpi": dpi,
+          "book_dimensions": book_dimensions,
+          "suppressions": sorted(suppressions),
+          "pages": sorted(etags),
+          "etags": etags}
+
+def file_etag(stat):
+  """Changes whenever a file is rewritten, even under the same name."""
+  return '"%x-%x"' % (int(stat.st_mtime * 1000), stat.st_size)
+
+def send_json(handler, data):
+  """Book state changes all the time, so never cache it."""
+  import json
+  body = json.dumps(data)
+  handler.send_response(200)
+  handler.send_header("Content-Type", "application/json")
+  handler.send_header("Content-Length", str(len(body)))
+  handler.send_header("Cache-Control", "no-cache")
+  handler.end_headers()
+  handler.wfile.write(body)
+
+def send_file(handler, filename):
+  """Static file with the caching and range headers clients expect."""
+  import mimetypes
+  try:
+    f = open(filename, "rb")
+  except IOError:
+    handler.send_error(404)
+    return
+  stat = os.fstat(f.fileno())
+  size, mtime, etag = stat.st_size, stat.st_mtime, file_etag(stat)
+  if handler.headers.get("If-None-Match") == etag:
+    handler.send_response(304)
+    handler.end_headers()
+    f.close()
+    return
+  start, end = 0, size - 1
+  byte_range = re.match(r'bytes=(\d*)-(\d*)$', handler.headers.get("Range", ""))
+  if byte_range and (byte_range.group(1) or byte_range.group(2)):
+    if byte_range.group(1):
+      start = int(byte_range.group(1))
+      if byte_range.group(2):
+        end = min(end, int(byte_range.group(2)))
+    else:
+      start = max(0, size - int(byte_range.group(2)))  # Last N bytes
+    if start > end:
+      handler.send_response(416)
+      handler.send_header("Content-Range", "bytes */%d" % size)
+      handler.end_headers()
+      f.close()
+      return
+    handler.send_response(206)
+    handler.send_header("Content-Range", "bytes %d-%d/%d" % (start, end, size))
+  else:
+    handler.send_response(200)
+  content_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+  handler.send_header("Content-Type", content_type)
+  handler.send_header("Content-Length", str(end - start + 1))
+  handler.send_header("Accept-Ranges", "bytes")
+  handler.send_header("ETag", etag)
+  handler.send_header("Last-Modified", handler.date_time_string(mtime))
+  handler.send_header("Cache-Control", "max-age=3600")
+  handler.end_headers()
+  f.seek(start)
+  remaining = end - start + 1
+  while remaining > 0:
+    data = f.read(min(remaining, 1 << 16))
+    if not data:
+      break
+    handler.wfile.write(data)
+    remaining -= len(data)
+  f.close()
+
+def make_thumbnail(playground, name):
+  """Small version of a page JPEG, made once and kept on disk."""
+  kThumbnailHeight = 256  # screen pixels
+  jpeg = os.path.join(playground, name)
+  thumbnail = os.path.join(playground, "thumbnails", name)
+  try:
+    if os.path.getmtime(thumbnail) >= os.path.getmtime(jpeg):
+      return thumbnail
+  except OSError:
+    pass
+  if not os.path.isdir(os.path.dirname(thumbnail)):
+    os.makedirs(os.path.dirname(thumbnail))
+  image = pygame.image.load(jpeg)
+  w = image.get_width() * kThumbnailHeight // image.get_height()
+  scale = pygame.transform.smoothscale(image, (w, kThumbnailHeight))
+  tmp = os.path.join(os.path.dirname(thumbnail), "tmp-" + name)
+  pygame.image.save(scale, tmp)
+  os.rename(tmp, thumbnail)
+  return thumbnail
+
+def serve(playground, port):
+  """Let reviewers on other stations look at this playground over HTTP.
+
+  Returns the server, ready for serve_forever(); port 0 picks a free one.
+  """
+  import BaseHTTPServer
+  import SocketServer
+  lock = threading.Lock()  # Book state lives in globals
+  pages = re.compile(r'^(\d{6}-\d+-\d+-\d+\.(jpg|html)|book\.pdf)$')
+
+  class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    def do_GET(self):
+      path = self.path.split("?")[0].lstrip("/")
+      if path == "book.json":
+        with lock:
+          data = book_json(playground)
+        send_json(self, data)
+      elif path.startswith("thumbnails/") and pages.match(path[11:]) and \
+            path.endswith(".jpg"):
+        try:
+          with lock:
+            thumbnail = make_thumbnail(playground, path[11:])
+        except (OSError, pygame.error):
+          self.send_error(404)
+          return
+        send_file(self, thumbnail)
+      elif pages.match(path):
+        send_file(self, os.path.join(playground, path))
+      else:
+        self.send_error(404)
+
+    def suppress(self, suppressed):
+      """PUT and DELETE, so two reviewers can't undo each other."""
+      suppression = re.match(r'^/suppressions/(\d+)$', self.path)
+      if not suppression:
+        self.send_error(404)
+        return
+      with lock:
+        set_suppressions(playground, int(suppression.group(1)), suppressed)
+        data = book_json(playground)
+      send_json(self, data)
+
+    def do_PUT(self):
+      self.suppress(True)
+
+    def do_DELETE(self):
+      self.suppress(False)
+
+  class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+  server = Server(("", port), Handler)
+  print("Serving %s on port %d" % (playground, server.server_address[1]))
+  return server
+
+def fetch(url, path, method=None):
+  """Read something from a station running serve()."""
+  import urllib2
+  request = urllib2.Request(url.rstrip("/") + "/" + path)
+  if method:
+    request.get_method = lambda: method
+  return urllib2.urlopen(request, None, 10).read()
+
+def fetch_book(url, path="book.json", method=None):
+  """Adopt remote book state; return (JPEG name, ETag) by page number."""
+  import json
+  global book_dimensions
+  global suppressions
+  book = json.loads(fetch(url, path, method))
+  book_dimensions = book["book_dimensions"]
+  suppressions = set(book["suppressions"])
+  etags = book.get("etags", {})
+  return dict((int(name.split("-")[0]), (name, etags.get(name)))
+              for name in book["pages"])
+
+def remote_page(url, pages, number, h, prefix=""):
+  """Page image from the server scaled to height h, blue if unavailable."""
+  blank = pygame.Surface((h * 2 // 3, h))
+  blank.fill(blue())
+  if number not in pages:
+    return blank  # Not cropped yet
+  name, etag = pages[number]
+  path = prefix + name
+  key = (path, etag, h)
+  if key in remote_pages:
+    touch_memory("remote %s %s %d" % key)
+    return remote_pages[key]
+  try:
+    image = pygame.image.load(cStringIO.StringIO(fetch(url, path)), path)
+  except (IOError, pygame.error):
+    return blank
+  w = image.get_width() * h // image.get_height()
+  page = pygame.transform.smoothscale(image, (w, h))
+  if hold_memory("remote %s %s %d" % key, surface_bytes(page), 1,
+                 lambda: remote_pages.pop(key, None)):
+    remote_pages[key] = page  # Oldest pages make room, see hold_memory()
+  else:
+    release_memory("remote %s %s %d" % key)
+  return page
+
+def render_remote_mosaic(url, pages, screen):
+  """Thumbnails of many pairs at once, fetched as they are drawn."""
+  size, windowsize, start, columns = mosaic_dimensions(screen)
+  last = max(pages)
+  for i in range(start, start + windowsize, 2):
+    if i > last:
+      break
+    x = ((i - start) // 2) % columns
+    y = ((i - start) // 2) // columns
+    dst = (size[0] * x, size[1] * y)
+    a = remote_page(url, pages, i, size[1], "thumbnails/")
+    b = remote_page(url, pages, i + 1, size[1], "thumbnails/")
+    screen.blit(a, (dst[0] + size[0] // 2 - a.get_width(), dst[1]))
+    screen.blit(b, (dst[0] + size[0] // 2, dst[1]))
+    if i in suppressions:
+      red = pooled_surface("suppressed tile", size, 1, pygame.Color('red'), 128)
+      if red is not None:
+        screen.blit(red, dst)
+    pygame.display.update(pygame.Rect(dst, size))
+
+def review(url):
+  """Thin client for serve(), so QA can happen away from the scanner."""
+  import httplib
+  global image_number
+  global fullscreen
+  pygame.init()
+  fullsize = (pygame.display.Info().current_w, pygame.display.Info().current_h)
+  set_pygame_window(fullsize, fullscreen)
+  screen = pygame.display.get_surface()
+  pages = fetch_book(url)
+  image_number = 1
+  pygame.time.set_timer(pygame.USEREVENT, 5000)  # Scanning may be ongoing
+  mosaic = False
+  dirty = True
+  trouble = None  # Why the server didn't answer last time, if it didn't
+  while True:
+    if dirty:
+      clearscreen(screen)
+      if mosaic and pages:
+        render_remote_mosaic(url, pages, screen)
+      else:
+        h = screen.get_height()
+        scale_a = remote_page(url, pages, image_number, h)
+        scale_b = remote_page(url, pages, image_number + 1, h)
+        draw(screen, image_number, scale_a, scale_b, False)
+        pygame.display.update()
+      if trouble:
+        render_text(screen, "\n\n%s" % trouble, "upperright")
+      pygame.display.set_caption("%d %s" % (image_number, url))
+      dirty = False
+    event = pygame.event.wait()
+    if event.type == pygame.QUIT:
+      pygame.quit()
+      sys.exit()
+    elif event.type == pygame.USEREVENT:
+      try:
+        state = (pages, suppressions, trouble)
+        pages = fetch_book(url)
+        trouble = None
+        dirty = state != (pages, suppressions, trouble)
+      except (IOError, httplib.HTTPException), e:
+        dirty = trouble is None
+        trouble = "Server unreachable: %s" % e
+    elif event.type == pygame.VIDEORESIZE:
+      screen = pygame.display.set_mode(event.size, pygame.RESIZABLE)
+      dirty = True
+    elif event.type == pygame.MOUSEBUTTONUP and event.button == 2:
+      mosaic = not mosaic
+      dirty = True
+    elif event.type == pygame.MOUSEBUTTONUP and event.button == 1 and mosaic:
+      size, unused, start, columns = mosaic_dimensions(screen)
+      x, y = event.pos[0] // size[0], event.pos[1] // size[1]
+      candidate = start + 2 * (columns * y + x)
+      if x < columns and (candidate in pages or candidate + 1 in pages):
+        image_number = candidate
+      mosaic = False
+      dirty = True
+    elif event.type == pygame.KEYDOWN:
+      dirty = True
+      if event.key == pygame.K_ESCAPE or event.key == pygame.K_q:
+        pygame.quit()
+        sys.exit()
+      elif event.key == pygame.K_DELETE or event.key == pygame.K_BACKSPACE:
+        if image_number in suppressions:
+          method = "DELETE"
+        else:
+          method = "PUT"
+        try:
+          pages = fetch_book(url, "suppressions/%d" % image_number, method)
+          trouble = None
+        except (IOError, httplib.HTTPException), e:
+          trouble = "Suppression not saved: %s" % e
+      elif event.key == pygame.K_F11 or event.key == pygame.K_f:
+        fullscreen = not fullscreen
+        set_pygame_window(fullsize, fullscreen)
+        screen = pygame.display.get_surface()
+      elif event.key == pygame.K_LEFT or event.key == pygame.K_UP:
+        image_number -= 2
+      elif event.key == pygame.K_RIGHT or event.key == pygame.K_DOWN:
+        image_number += 2
+      elif event.key == pygame.K_PAGEUP:
+        image_number -= 10
+      elif event.key == pygame.K_PAGEDOWN:
+        image_number += 10
+      elif event.key == pygame.K_HOME:
+        image_number = 1
+      last = max(pages.keys() + [1])
+      if event.key == pygame.K_END:
+        image_number = last
+      image_number = max(1, min(image_number, last - 1 + last % 2))  # left page
 
 # Glyphless variation of vedaal's invisible font retrieved from
 # http://www.angelfire.com/pr/pgpf/if.html, which says:
@@ -754,6 +1858,13 @@ AAIAAQABAAIAAQAEAAAAAgAAAAAAAQAAAADG1C6ZAAAAAL9MkvAAAAAAzFTgIQ==
 
 if __name__ == "__main__":
   if len(sys.argv) == 1:
-    print("Usage: %s <imgdir>\n" % os.path.basename(sys.argv[0]))
+    print("Usage: %s <imgdir> | --serve <imgdir> [port] | <url>\n" %
+          os.path.basename(sys.argv[0]))
+  elif sys.argv[1] == "--serve" and len(sys.argv) > 3:
+    serve(sys.argv[2].rstrip('/'), int(sys.argv[3])).serve_forever()
+  elif sys.argv[1] == "--serve" and len(sys.argv) > 2:
+    serve(sys.argv[2].rstrip('/'), 8000).serve_forever()
+  elif sys.argv[1].startswith("http://"):
+    review(sys.argv[1])
   else:
     main(sys.argv[1])